@@ -18,6 +18,8 @@ import sys
 import smtplib
 import zipfile
 import codecs
+import re
+import shutil
 
 from lxml import etree
 
@@ -33,6 +35,12 @@ except ImportError:
     # 2.x name
     import ConfigParser as configparser
 
+try:
+    # used for reflinks (copy-on-write clones); not available on Windows
+    import fcntl
+except ImportError:
+    fcntl = None
+
 # relevant urls
 LOGIN_URL = "https://www.packtpub.com/"
 GRAB_URL = "https://www.packtpub.com/packt/offers/free-learning"
@@ -63,6 +71,12 @@ HEADERS = {
 BASE_DIRECTORY = os.path.dirname(os.path.realpath(__file__)) + os.sep
 DOWNLOAD_DIRECTORY = BASE_DIRECTORY + 'tmp' + os.sep
 
+# the directory inside the library holding a single copy of each book, shared by all accounts
+LIBRARY_STORE_DIRECTORY = '.store'
+
+# ioctl request for cloning a file on copy-on-write file systems (btrfs, xfs)
+FICLONE = 0x40049409
+
 # a minimal helper class for storing configuration keys and value
 class Config(dict):
     pass
@@ -107,6 +121,13 @@ def configure():
         config.email_max_size = configuration.getint('mail', 'max_size')
         config.email_delete = configuration.getboolean('mail', 'delete')
 
+    # the library section is optional; older configuration files don't have it
+    config.library_enabled = configuration.has_section('library') and configuration.getboolean('library', 'enabled')
+
+    if config.library_enabled:
+        config.library_directory = os.path.join(BASE_DIRECTORY, configuration.get('library', 'directory'))
+        config.library_types = configuration.get('library', 'types')
+
     return config
 
 
@@ -251,12 +272,13 @@ def claim(session, claim_path):
     return req.status_code == 200, req.text
 
 
-def prepare_links(config, book_element):
+def prepare_links(config, book_element, types):
     """Prepares requested links.
 
     Keyword arguments:
     config -- the configuration object
     book_element -- an etree.Element describing a Packt Publishing book
+    types -- the requested file types, e.g. pemc
     """
 
     # get the book id
@@ -277,7 +299,7 @@ def prepare_links(config, book_element):
 
     # get the links that should be executed
     links = {}
-    for option in list(str(config.email_types)):
+    for option in list(str(types)):
         if option in list("pemc"):
             # perform the option, e.g. get the pdf, epub, mobi and/or code link
             dl_type, link = valid_option_links[option]
@@ -493,6 +515,142 @@ def handle_error_message(config, err, book_name, links, is_new_book):
     send_message(config, message, book_name, links, is_new_book)
 
 
+def library_name(name):
+    """Makes a name safe for use as a file or directory name in the library.
+
+    Keyword arguments:
+    name -- the name to sanitize, e.g. a book title or an account
+    """
+    name = re.sub(r'[\\/:*?"<>|]', '_', name).strip().strip('.')
+
+    return name if name else '_'
+
+
+def reflink(source, destination):
+    """Clones a file on a copy-on-write file system; returns whether it succeeded.
+
+    Keyword arguments:
+    source -- the file object to clone
+    destination -- the (empty) file object to clone into
+    """
+    if fcntl is None:
+        return False
+
+    try:
+        fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+    except (IOError, OSError):
+        # not supported by the file system or the files are on different file systems
+        return False
+
+    return True
+
+
+def kernel_copy(source, destination):
+    """Copies a file inside the kernel where possible, falling back to a user space copy.
+
+    Keyword arguments:
+    source -- the file object to copy from
+    destination -- the (empty) file object to copy into
+    """
+    size = os.fstat(source.fileno()).st_size
+    offset = 0
+
+    # copy_file_range (Python 3.8+, Linux) may also let the file system share or offload blocks
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(source.fileno(), destination.fileno(), size - offset, offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+        except OSError:
+            pass
+
+    # sendfile only accepts regular files as output on Linux; other platforms raise an error
+    if offset < size and hasattr(os, 'sendfile'):
+        try:
+            os.lseek(destination.fileno(), offset, os.SEEK_SET)
+            while offset < size:
+                sent = os.sendfile(destination.fileno(), source.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError:
+            pass
+
+    # copy whatever is left the old fashioned way
+    if offset < size:
+        source.seek(offset)
+        destination.seek(offset)
+        shutil.copyfileobj(source, destination)
+
+
+def place_file(source, destination):
+    """Places a file at a destination without reading it through Python where possible.
+
+    A hardlink is tried first, so all library entries share the same disk blocks. When that
+    fails (e.g. different file systems), a reflink is tried, followed by a kernel side copy.
+
+    Keyword arguments:
+    source -- the name of the file to place
+    destination -- the name of the file to create
+    """
+    try:
+        os.link(source, destination)
+        return
+    except (OSError, AttributeError):
+        # AttributeError: os.link is not available on Windows with Python 2
+        pass
+
+    # copy into a partial file first, so an interrupted copy never ends up in the library
+    partial_filename = destination + '.part'
+    with open(source, 'rb') as source_file:
+        with open(partial_filename, 'wb') as destination_file:
+            if not reflink(source_file, destination_file):
+                kernel_copy(source_file, destination_file)
+
+    os.rename(partial_filename, destination)
+
+
+def file_into_library(config, book_id, book_title, files):
+    """Files downloaded books into the library, organised per account, title and format.
+
+    Every book is kept once in the store of the library; the entries of the accounts are
+    hardlinks to it, so a book claimed by multiple accounts only takes up disk space once.
+
+    Keyword arguments:
+    config -- the configuration object
+    book_id -- the identifier of the book
+    book_title -- the title of the book
+    files -- a dictionary of dl_type => file name
+    """
+    store_directory = os.path.join(config.library_directory, LIBRARY_STORE_DIRECTORY)
+    title = library_name(book_title.replace(u' [eBook]', u''))
+    book_directory = os.path.join(config.library_directory, library_name(config.username), title)
+
+    for directory in (store_directory, book_directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    library_files = {}
+    for dl_type, filename in files.items():
+        # the code is delivered as a zip file
+        extension = dl_type if dl_type != 'code' else 'zip'
+        store_filename = os.path.join(store_directory, str(book_id) + '.' + extension)
+        library_filename = os.path.join(book_directory, title + '.' + extension)
+
+        # a book already in the store was filed before, possibly by another account
+        if not os.path.exists(store_filename):
+            place_file(filename, store_filename)
+
+        if not os.path.exists(library_filename):
+            place_file(store_filename, library_filename)
+
+        library_files[dl_type] = library_filename
+
+    return library_files
+
+
 def cleanup(config, files, zip_filename=""):
     """Removes temporary downloaded files.
 
@@ -505,8 +663,8 @@ def cleanup(config, files, zip_filename=""):
     if zip_filename != "" and os.path.exists(zip_filename):
         os.remove(zip_filename)
 
-    # check if we have to delete the downloaded files...
-    if config.email_delete:
+    # check if we have to delete the downloaded files; without mail, the library holds them
+    if not config.email_enabled or config.email_delete:
         for _, filename in files.items():
             if os.path.exists(filename):
                 os.remove(filename)
@@ -603,7 +761,7 @@ def main():
 
                         if has_claimed:
 
-                            if config.email_enabled:
+                            if config.email_enabled or config.library_enabled:
 
                                 # following is a redundant check; first verion of uniqueness;
                                 # the book_id should be the nid of the first child of the list of books on the my-ebooks page                               
@@ -618,32 +776,47 @@ def main():
                                     # extract the name of the book
                                     book_title = book_element.get('title')
 
-                                    # get the links that should be downloaded and/or listed in mail
-                                    links = prepare_links(config, book_element)
+                                    # get the links that should be listed in mail and/or filed into the library
+                                    links = prepare_links(config, book_element, config.email_types) if config.email_enabled else {}
+                                    library_links = prepare_links(config, book_element, config.library_types) if config.library_enabled else {}
 
-                                    # if we only want the links, we're basically ready for sending an email
-                                    # else we need some more juggling downloading the goodies
+                                    # determine which links should actually be downloaded
+                                    download_links = dict(library_links)
+                                    if config.email_enabled and not config.email_links_only:
+                                        download_links.update(links)
+
+                                    # first download the files to a temporary location relative to grabpackt
                                     files = {}
+                                    if download_links:
+                                        files = download(session, book_id, download_links)
+
+                                    # file the requested types into the library
+                                    if config.library_enabled:
+                                        file_into_library(config, book_id, book_title, {dl_type: files[dl_type] for dl_type in library_links})
+
+                                    # if we only want the links, we're basically ready for sending an email
+                                    # else we need some more juggling with the goodies
+                                    email_files = {}
                                     zip_filename = ""
-                                    if not config.email_links_only:
-                                        # first download the files to a temporary location relative to grabpackt
-                                        files = download(session, book_id, links)
+                                    if config.email_enabled:
+                                        if not config.email_links_only:
+                                            email_files = {dl_type: files[dl_type] for dl_type in links}
 
-                                        # next check if we need to zip the downloaded files
-                                        if config.email_zip:
-                                            # only pack files when there is more than 1, or has been enforced
-                                            if len(files) > 1 or config.email_force_zip:
-                                                zip_filename = create_zip(files, book_title)
+                                            # next check if we need to zip the downloaded files
+                                            if config.email_zip:
+                                                # only pack files when there is more than 1, or has been enforced
+                                                if len(email_files) > 1 or config.email_force_zip:
+                                                    zip_filename = create_zip(email_files, book_title)
 
 
-                                    # prepare attachments for sending
-                                    attachments = prepare_attachments(config, files, zip_filename)
+                                        # prepare attachments for sending
+                                        attachments = prepare_attachments(config, email_files, zip_filename)
 
-                                    # construct the email with all necessary items...
-                                    message = create_message(config, book_title, links, attachments, is_new_book=True)
+                                        # construct the email with all necessary items...
+                                        message = create_message(config, book_title, links, attachments, is_new_book=True)
 
-                                    # send the email...
-                                    send_message(config, message, book_title, links, is_new_book=True)
+                                        # send the email...
+                                        send_message(config, message, book_title, links, is_new_book=True)
 
                                     # perform cleanup
                                     cleanup(config, files, zip_filename)